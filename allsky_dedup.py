@@ -0,0 +1,364 @@
+import os
+import cv2
+import json
+import time
+import numpy as np
+
+# --- CONFIGURATION ---
+# The root directory containing your labeled image folders (e.g., training_data/Cloudy)
+INPUT_DIR = r'E:\observatory design\Allsky_AI_Training'
+# The index file that caches frame hashes between runs (new nights are hashed incrementally)
+INDEX_FILE = 'allsky_dedup_index.json'
+# Output files: unique frames to use for preprocessing/training, and near-duplicate
+# frames that can be removed. Frames dropped only by MAX_FRAMES_PER_CLASS are left out
+# of the manifest but never go on the delete list.
+MANIFEST_FILE = 'allsky_dedup_manifest.txt'
+DELETE_LIST_FILE = 'allsky_dedup_delete_list.txt'
+# Same center crop as the preprocessing script, so the timestamp/overlay text in the
+# corners of the frame does not stop two identical skies from matching.
+INITIAL_CROP_SIZE = (1300, 1300)
+# Maximum number of differing bits (out of 64) for two frames to count as near-duplicates.
+# 0 only removes pixel-identical frames; 4-6 removes long runs of an unchanging sky.
+SIMILARITY_THRESHOLD = 5
+# Optional cap on unique frames listed per class, to stop one very common class from
+# dominating training. 0 lists every unique frame (no cap).
+MAX_FRAMES_PER_CLASS = 0
+# Warn when a class has fewer unique frames than this fraction of the largest class
+CLASS_IMBALANCE_WARNING = 0.1
+# How often (in seconds) the index is saved while hashing, so an interrupted run keeps its progress
+INDEX_SAVE_INTERVAL = 300
+# Set to True to actually delete the near-duplicates in the delete list (otherwise it is only written out)
+DELETE_DUPLICATES = False
+# ---------------------
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+HASH_SIZE = 8
+
+
+def compute_frame_hash(image_path, initial_crop_size=INITIAL_CROP_SIZE):
+    """
+    Computes a 64-bit difference hash (dHash) of an image. Frames that look the same
+    produce hashes that differ in only a few bits, even after JPEG noise or small
+    brightness changes.
+    Returns the hash as an int, or None if the image cannot be read.
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+
+    # 1. Center Crop (skipped if the image is smaller than the crop or the crop is disabled)
+    if initial_crop_size is not None:
+        crop_w, crop_h = initial_crop_size
+        h, w = image.shape[:2]
+        if 0 < crop_w <= w and 0 < crop_h <= h:
+            start_x = (w - crop_w) // 2
+            start_y = (h - crop_h) // 2
+            image = image[start_y:start_y + crop_h, start_x:start_x + crop_w]
+
+    # 2. Shrink to (HASH_SIZE + 1) x HASH_SIZE and compare horizontally adjacent pixels
+    small = cv2.resize(image, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing for fast Hamming-distance search over 64-bit hashes.
+    Each hash is split into max_distance + 1 chunks, and each chunk has its own lookup
+    table. Two hashes within max_distance bits must agree exactly on at least one chunk,
+    so a query only compares the full hash against frames sharing a chunk with it,
+    instead of against every stored frame.
+    """
+
+    def __init__(self, max_distance, hash_bits=HASH_SIZE * HASH_SIZE):
+        if not 0 <= max_distance < hash_bits:
+            raise ValueError(f"max_distance must be between 0 and {hash_bits - 1}, got {max_distance}")
+        self.max_distance = max_distance
+        self.size = 0
+
+        # Split the hash into chunks of near-equal width: (shift, mask) per chunk
+        num_chunks = max_distance + 1
+        self.chunks = []
+        shift = 0
+        for i in range(num_chunks):
+            width = hash_bits // num_chunks + (1 if i < hash_bits % num_chunks else 0)
+            self.chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self.tables = [{} for _ in self.chunks]
+
+    def add(self, frame_hash, frame_key):
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            table.setdefault((frame_hash >> shift) & mask, []).append((frame_hash, frame_key))
+        self.size += 1
+
+    def find_within(self, frame_hash):
+        """Returns (distance, frame_key) of the closest stored hash within max_distance, or None."""
+        best = None
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            for stored_hash, frame_key in table.get((frame_hash >> shift) & mask, ()):
+                distance = hamming_distance(frame_hash, stored_hash)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, frame_key)
+                    if distance == 0:
+                        return best
+        return best
+
+
+def load_index(index_path, initial_crop_size):
+    """Loads the hash index, or starts a new one if it is missing or was built with a different crop."""
+    empty_index = {
+        "HASH_SIZE": HASH_SIZE,
+        "INITIAL_CROP_SIZE": list(initial_crop_size) if initial_crop_size else None,
+        "SIMILARITY_THRESHOLD": None,
+        "FRAMES": {},
+    }
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return empty_index
+
+    if index.get("HASH_SIZE") != empty_index["HASH_SIZE"] or \
+            index.get("INITIAL_CROP_SIZE") != empty_index["INITIAL_CROP_SIZE"]:
+        print("Hash settings changed since the index was built. Rebuilding the index from scratch.")
+        return empty_index
+    return index
+
+
+def save_index(index, index_path):
+    """Writes the index atomically so an interrupted run never corrupts it."""
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_path, index_path)
+
+
+def scan_frames(input_dir):
+    """
+    Finds all raw frames inside the class folders below input_dir. The class label is
+    the top-level folder under input_dir (e.g., Clear/night2/frame.jpg is 'Clear'), the
+    same layout the training script's data generator expects. Files sitting directly in
+    input_dir (such as the monitor's latest.jpg) belong to no class and are ignored.
+    Returns a sorted list of (relative_path, label).
+    """
+    frames = []
+    for root, dirs, files in os.walk(input_dir):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS) and '_prepped.' not in file.lower():
+                rel_path = os.path.relpath(os.path.join(root, file), input_dir)
+                parts = rel_path.split(os.sep)
+                if len(parts) < 2:
+                    continue
+                frames.append((rel_path, parts[0]))
+    # Allsky filenames are timestamped, so sorting keeps each night in capture order
+    frames.sort()
+    return frames
+
+
+def update_hashes(index, input_dir, frames, initial_crop_size, index_path=None):
+    """
+    Hashes frames that are new or modified since the last run. If index_path is given,
+    the index is saved every INDEX_SAVE_INTERVAL seconds so an interrupted run keeps
+    its progress without rewriting a large index file after every batch of frames.
+    Returns (number hashed, number loaded from the index).
+    """
+    stored = index["FRAMES"]
+    current = set(rel_path for rel_path, label in frames)
+
+    # Forget frames that have been removed from disk
+    for rel_path in list(stored):
+        if rel_path not in current:
+            del stored[rel_path]
+
+    hashed = 0
+    cached = 0
+    last_save = time.monotonic()
+    for rel_path, label in frames:
+        full_path = os.path.join(input_dir, rel_path)
+        mtime = os.path.getmtime(full_path)
+        entry = stored.get(rel_path)
+        if entry is not None and entry["mtime"] == mtime and entry["label"] == label:
+            cached += 1
+            continue
+
+        frame_hash = compute_frame_hash(full_path, initial_crop_size)
+        if frame_hash is None:
+            print(f"Warning: Could not read image {full_path}. Skipping.")
+            stored.pop(rel_path, None)
+            continue
+
+        stored[rel_path] = {"hash": format(frame_hash, '016x'), "mtime": mtime, "label": label, "duplicate_of": None,
+                            "checked": False}
+        hashed += 1
+        if hashed % 1000 == 0:
+            print(f"Hashed {hashed} new frames...")
+        if index_path is not None and time.monotonic() - last_save >= INDEX_SAVE_INTERVAL:
+            save_index(index, index_path)
+            last_save = time.monotonic()
+    return hashed, cached
+
+
+def find_duplicates(index, frames, threshold):
+    """
+    Marks every frame whose hash is within threshold bits of an earlier unique frame of
+    the same class. Only new frames are compared when the threshold is unchanged;
+    changing the threshold re-checks the whole archive from the cached hashes.
+    """
+    stored = index["FRAMES"]
+    recheck_all = index.get("SIMILARITY_THRESHOLD") != threshold
+    index["SIMILARITY_THRESHOLD"] = threshold
+
+    indexes = {}
+    pending = []
+    for rel_path, label in frames:
+        entry = stored.get(rel_path)
+        if entry is None:
+            continue
+        target = stored.get(entry["duplicate_of"]) if entry["duplicate_of"] is not None else None
+        if recheck_all or not entry["checked"] or (entry["duplicate_of"] is not None and (
+                target is None or not target["checked"] or target["duplicate_of"] is not None)):
+            # New frames, and duplicates whose matching frame has since been removed,
+            # re-hashed, or is no longer unique itself
+            pending.append((rel_path, entry))
+        elif entry["duplicate_of"] is None:
+            # Previously unique frames seed the search index
+            if label not in indexes:
+                indexes[label] = MultiIndexHash(threshold)
+            indexes[label].add(int(entry["hash"], 16), rel_path)
+
+    for rel_path, entry in pending:
+        frame_hash = int(entry["hash"], 16)
+        if entry["label"] not in indexes:
+            indexes[entry["label"]] = MultiIndexHash(threshold)
+        search_index = indexes[entry["label"]]
+        match = search_index.find_within(frame_hash)
+        if match is None:
+            entry["duplicate_of"] = None
+            search_index.add(frame_hash, rel_path)
+        else:
+            entry["duplicate_of"] = match[1]
+        entry["checked"] = True
+
+    return {label: search_index.size for label, search_index in indexes.items()}
+
+
+def balance_classes(index, frames, max_frames_per_class):
+    """
+    Picks the unique frames to keep. If max_frames_per_class is above 0 and a class has
+    more unique frames than that, frames are taken at even steps through capture order
+    so every night stays represented. 0 keeps every unique frame.
+    Returns a dict of label -> list of kept relative paths.
+    """
+    stored = index["FRAMES"]
+    unique = {}
+    for rel_path, label in frames:
+        entry = stored.get(rel_path)
+        if entry is not None and entry["duplicate_of"] is None:
+            unique.setdefault(label, []).append(rel_path)
+
+    if not unique:
+        return {}
+
+    largest = max(len(paths) for paths in unique.values())
+    for label in sorted(unique):
+        if len(unique[label]) < largest * CLASS_IMBALANCE_WARNING:
+            print(f"Warning: Class '{label}' has only {len(unique[label])} unique frames "
+                  f"(largest class has {largest}). Consider collecting more {label} frames.")
+
+    kept = {}
+    for label, paths in unique.items():
+        if max_frames_per_class <= 0 or len(paths) <= max_frames_per_class:
+            kept[label] = paths
+        else:
+            positions = np.linspace(0, len(paths) - 1, max_frames_per_class).round().astype(int)
+            kept[label] = [paths[i] for i in positions]
+    return kept
+
+
+def deduplicate_archive(input_dir, index_path=INDEX_FILE, manifest_path=MANIFEST_FILE,
+                        delete_list_path=DELETE_LIST_FILE, threshold=SIMILARITY_THRESHOLD,
+                        max_frames_per_class=MAX_FRAMES_PER_CLASS, initial_crop_size=INITIAL_CROP_SIZE,
+                        delete_duplicates=DELETE_DUPLICATES):
+    """
+    Thins a labeled allsky archive down to a set of visually distinct frames
+    (optionally capped per class), so preprocess_images and the training script only see frames that add
+    information. Hashes are cached in the index, so re-running after adding a new
+    night only hashes and compares the new frames.
+
+    Args:
+        input_dir (str): The root directory containing your labeled image folders.
+        index_path (str): JSON file that stores the frame hashes between runs.
+        manifest_path (str): Output list of unique frames to use (one relative path per line).
+        delete_list_path (str): Output list of near-duplicate frames (one relative path per line).
+        threshold (int): Maximum Hamming distance (bits out of 64) to treat two frames as duplicates.
+        max_frames_per_class (int): Cap on manifest frames per class. 0 means no cap.
+                                    Frames over the cap stay on disk and off the delete list.
+        initial_crop_size (tuple): Center crop applied before hashing. None skips the crop.
+        delete_duplicates (bool): If True, the near-duplicates in the delete list are removed from
+                                  disk, together with their '_prepped' copies.
+    """
+    print("--- Starting Allsky Archive Deduplication ---")
+
+    index = load_index(index_path, initial_crop_size)
+    frames = scan_frames(input_dir)
+    print(f"1. Found {len(frames)} frames in {input_dir}.")
+
+    hashed, cached = update_hashes(index, input_dir, frames, initial_crop_size, index_path)
+    print(f"2. Hashed {hashed} new or modified frames ({cached} loaded from the index).")
+
+    unique_counts = find_duplicates(index, frames, threshold)
+    save_index(index, index_path)
+    for label in sorted(unique_counts):
+        print(f"3. {label}: {unique_counts[label]} unique frames at threshold {threshold}.")
+
+    kept = balance_classes(index, frames, max_frames_per_class)
+    kept_paths = set(path for paths in kept.values() for path in paths)
+    removed_paths = [rel_path for rel_path, label in frames
+                     if rel_path in index["FRAMES"] and index["FRAMES"][rel_path]["duplicate_of"] is not None]
+    capped = sum(unique_counts.values()) - len(kept_paths)
+
+    with open(manifest_path, 'w') as f:
+        for label in sorted(kept):
+            for rel_path in kept[label]:
+                f.write(f"{rel_path}\n")
+    with open(delete_list_path, 'w') as f:
+        for rel_path in removed_paths:
+            f.write(f"{rel_path}\n")
+
+    print(f"4. Selected {len(kept_paths)} of {len(frames)} frames "
+          f"({', '.join(f'{label}: {len(paths)}' for label, paths in sorted(kept.items()))}).")
+    print(f"   Manifest: {manifest_path} ({capped} unique frames left out by the per-class cap)")
+    print(f"   Delete list: {delete_list_path} ({len(removed_paths)} frames)")
+
+    if delete_duplicates:
+        deleted = 0
+        for rel_path in removed_paths:
+            full_path = os.path.join(input_dir, rel_path)
+            base_name, ext = os.path.splitext(full_path)
+            prepped_path = f"{base_name}_prepped{ext}"
+            try:
+                os.remove(full_path)
+                index["FRAMES"].pop(rel_path, None)
+                deleted += 1
+                # Also remove the preprocessed copy, if the archive was already prepped
+                if os.path.exists(prepped_path):
+                    os.remove(prepped_path)
+            except OSError as e:
+                print(f"Error deleting {full_path}: {e}")
+        save_index(index, index_path)
+        print(f"5. Deleted {deleted} of {len(removed_paths)} near-duplicate frames from disk.")
+
+    return sorted(kept_paths), removed_paths
+
+
+if __name__ == '__main__':
+    deduplicate_archive(INPUT_DIR)
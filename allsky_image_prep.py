@@ -2,7 +2,8 @@ import os
 import cv2
 import numpy as np
 
-def preprocess_images(input_dir, target_size=(224, 224), initial_crop_size=(1300, 1300)):
+def preprocess_images(input_dir, target_size=(224, 224), initial_crop_size=(1300, 1300), manifest_path=None,
+                      skip_existing=False):
     """
     Reads images from a directory and its subdirectories, performs a center crop
     to a specific size, resizes the result to a final target size, and saves the 
@@ -16,17 +17,45 @@ def preprocess_images(input_dir, target_size=(224, 224), initial_crop_size=(1300
                                    the image to before the final resize. Use None or 
                                    (0, 0) to skip the intermediate crop step.
                                    (e.g., 1300x1300)
+        manifest_path (str): Optional frame list written by allsky_dedup.py (one path per
+                             line, relative to input_dir). When given, only the listed
+                             frames are processed, and '_prepped' files left over from
+                             frames no longer in the manifest are deleted, so the
+                             '_prepped' images always match the manifest. Use None to
+                             process every image.
+        skip_existing (bool): If True, frames whose '_prepped' file already exists and is
+                              newer than the source are not processed again, so re-runs
+                              after adding a new night only prep the new frames. Leave
+                              False after changing target_size or initial_crop_size.
     """
     # Extract crop dimensions and set flag to skip if dimensions are invalid
     crop_w, crop_h = initial_crop_size
     skip_crop = crop_w <= 0 or crop_h <= 0 or initial_crop_size is None
 
+    # Load the list of frames to keep, if a deduplication manifest was given
+    keep_paths = None
+    if manifest_path is not None:
+        with open(manifest_path, 'r') as f:
+            keep_paths = set(os.path.normpath(line.strip()) for line in f if line.strip())
+        print(f"Processing only the {len(keep_paths)} frames listed in {manifest_path}.")
+
     # Walk through the input directory to find all image files
     for root, dirs, files in os.walk(input_dir):
         for file in files:
+            # Remove stale prepped files whose source frame has left the manifest
+            base_name, ext = os.path.splitext(file)
+            if keep_paths is not None and base_name.lower().endswith('_prepped'):
+                source_path = os.path.join(root, base_name[:-len('_prepped')] + ext)
+                if os.path.relpath(source_path, input_dir) not in keep_paths:
+                    os.remove(os.path.join(root, file))
+                    print(f"Removed stale prepped file: {os.path.join(root, file)}")
+                continue
+
             # Check if the file is a common image format AND is not already a prepped file
             if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')) and '_prepped.' not in file.lower():
                 input_path = os.path.join(root, file)
+                if keep_paths is not None and os.path.relpath(input_path, input_dir) not in keep_paths:
+                    continue
 
                 # --- NEW OUTPUT PATH LOGIC ---
                 # Create the new filename with a '_prepped' suffix
@@ -34,6 +63,10 @@ def preprocess_images(input_dir, target_size=(224, 224), initial_crop_size=(1300
                 new_file_name = f"{base_name}_prepped{ext}"
                 output_path = os.path.join(root, new_file_name)
                 # -----------------------------
+
+                if skip_existing and os.path.exists(output_path) and \
+                        os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                    continue
                 
                 try:
                     # Read the image
@@ -81,6 +114,8 @@ input_dir = r'E:\observatory design\Allsky_AI_Training'
 
 # The call below will first center-crop to 1300x1300, then resize to 224x224,
 # and save the result as 'original_name_prepped.jpg' in the original folder.
+# To only process the frames kept by allsky_dedup.py, and skip frames already prepped, add:
+#     manifest_path='allsky_dedup_manifest.txt', skip_existing=True
 preprocess_images(
     input_dir, 
     target_size=(224, 224), 